@@ -0,0 +1,295 @@
+; Display a gallery of still images on the NES. Assembles with ASM6.
+; Next image: A, start or right. Previous image: B or left.
+
+                include "gallery.inc"   ; generated by png2nesdata.py
+
+; --- Constants ---------------------------------------------------------------
+
+; RAM
+pointer         equ $00  ; 2 bytes
+image_index     equ $02  ; image being shown
+chr_set         equ $03  ; CHR set in CHR RAM ($ff = none)
+hscroll         equ $04  ; horizontal scroll value of image
+vscroll         equ $05  ; vertical   scroll value of image
+nmi_done        equ $06  ; set to $80 when the NMI routine has run
+joypad_status   equ $07  ; buttons pressed now (A,B,select,start,U,D,L,R)
+prev_joypad     equ $08  ; buttons pressed on the previous frame
+oam_copy        equ $0200  ; 256 bytes; sprites of image
+
+; memory-mapped registers
+ppu_ctrl        equ $2000
+ppu_mask        equ $2001
+ppu_status      equ $2002
+oam_addr        equ $2003
+ppu_scroll      equ $2005
+ppu_addr        equ $2006
+ppu_data        equ $2007
+dmc_freq        equ $4010
+oam_dma         equ $4014
+snd_chn         equ $4015
+joypad1         equ $4016
+joypad2         equ $4017
+
+; joypad buttons
+next_buttons    equ %10010001  ; A, start, right
+prev_buttons    equ %01000010  ; B, left
+
+; --- iNES header -------------------------------------------------------------
+
+                ; see https://wiki.nesdev.org/w/index.php/INES
+                base $0000
+                db "NES", $1a            ; file id
+                db prg_bank_count, 0     ; 16-KiB PRG ROM banks, CHR RAM
+                                         ; (over 16 banks: emulators only)
+                db %00100001, %00000000  ; UNROM mapper, vertical NT mirroring
+                pad $0010, $00           ; unused
+
+; --- Switchable PRG ROM banks ------------------------------------------------
+
+                ; CHR sets and image data generated by png2nesdata.py
+bank            = 0
+                rept prg_bank_count-1
+                base $8000
+                incbin "gallery-prg.bin", bank*$4000, $4000
+bank            = bank+1
+                endr
+
+; --- Fixed PRG ROM bank ------------------------------------------------------
+
+                base $c000
+
+tables          ; where each image is; generated by png2nesdata.py
+                incbin "gallery-tables.bin"
+
+                ; labels in tables (one byte per image in each table)
+img_bank        = tables+0*image_count  ; PRG bank of image data
+img_addr_lo     = tables+1*image_count  ; address of image data, low  byte
+img_addr_hi     = tables+2*image_count  ; address of image data, high byte
+img_chr_set     = tables+3*image_count  ; CHR set of image
+chr_bank        = tables+4*image_count  ; PRG bank of CHR set
+chr_addr_lo     = tables+5*image_count  ; address of CHR set, low  byte
+chr_addr_hi     = tables+6*image_count  ; address of CHR set, high byte
+
+                ; image data (see get_prg_data() in png2nesdata.py)
+nt_at_size      equ 1024                ; name & attribute table
+sprite_size     equ 256                 ; sprites
+palette_size    equ 4                   ; palette; followed by scroll values
+
+bank_table      ; values to switch PRG banks with (avoids bus conflicts)
+bank            = 0
+                rept prg_bank_count-1
+                db bank
+bank            = bank+1
+                endr
+
+reset           ; initialise the NES
+                ; see https://wiki.nesdev.org/w/index.php/Init_code
+                sei                     ; ignore IRQs
+                cld                     ; disable decimal mode
+                ldx #%01000000
+                stx joypad2             ; disable APU frame IRQ
+                ldx #$ff
+                txs                     ; initialize stack pointer
+                inx
+                stx ppu_ctrl            ; disable NMI
+                stx ppu_mask            ; disable rendering
+                stx dmc_freq            ; disable DMC IRQs
+                stx snd_chn             ; disable sound channels
+
+                jsr wait_vbl_start      ; wait until next VBlank starts
+                jsr wait_vbl_start      ; wait until next VBlank starts
+
+                ldy #$24                ; clear NT1 & AT1 ($400 bytes)
+                lda #$00
+                jsr set_ppu_addr        ; Y*$100+A -> address
+                tax
+                ldy #4
+-               sta ppu_data
+                inx
+                bne -
+                dey
+                bne -
+
+                lda #$ff                ; no CHR set loaded yet
+                sta chr_set
+                lda #0
+                sta image_index
+                sta nmi_done
+                sta prev_joypad
+                jsr load_image          ; load and show the first image
+                jsr show_image
+
+main_loop       bit nmi_done            ; wait until NMI routine has run
+                bpl main_loop
+                lda #$00
+                sta nmi_done
+
+                jsr read_joypad
+                lda prev_joypad         ; newly pressed buttons -> A
+                eor #$ff
+                and joypad_status
+                ldx joypad_status
+                stx prev_joypad
+
+                tax
+                and #next_buttons
+                bne next_image
+                txa
+                and #prev_buttons
+                bne prev_image
+                jmp main_loop
+
+next_image      inc image_index         ; wrap around after last image
+                lda image_index
+                cmp #<image_count
+                bne +
+                lda #0
+                sta image_index
++               jmp change_image
+
+prev_image      dec image_index         ; wrap around before first image
+                lda image_index
+                cmp #$ff
+                bne change_image
+                lda #image_count-1
+                sta image_index
+
+change_image    jsr load_image
+                jsr show_image
+                jmp main_loop
+
+load_image      ; copy image image_index to the PPU; disables rendering
+
+                lda #$00                ; disable NMI and rendering
+                sta ppu_ctrl
+                sta ppu_mask
+
+                ldx image_index         ; copy CHR set to CHR RAM unless it's
+                lda img_chr_set,x       ; already there ($2000 bytes)
+                cmp chr_set
+                beq +
+                sta chr_set
+                lda chr_bank,x
+                jsr switch_bank
+                lda chr_addr_lo,x
+                sta pointer+0
+                lda chr_addr_hi,x
+                sta pointer+1
+                ldy #$00
+                lda #$00
+                jsr set_ppu_addr        ; Y*$100+A -> address
+                ldx #32                 ; how many pages to copy
+                jsr copy_to_ppu
+
++               ldx image_index         ; switch to image data
+                lda img_bank,x
+                jsr switch_bank
+                lda img_addr_lo,x
+                sta pointer+0
+                lda img_addr_hi,x
+                sta pointer+1
+
+                ldy #$20                ; copy NT0 & AT0 data ($400 bytes)
+                lda #$00
+                jsr set_ppu_addr        ; Y*$100+A -> address
+                ldx #>nt_at_size        ; how many pages to copy
+                jsr copy_to_ppu
+
+                ldy #0                  ; copy sprites (1 page)
+-               lda (pointer),y
+                sta oam_copy,y
+                iny
+                bne -
+                inc pointer+1
+
+                ldy #$3f                ; copy palette
+                lda #$00
+                jsr set_ppu_addr        ; Y*$100+A -> address
+                ldx #8
+--              ldy #0
+-               lda (pointer),y
+                sta ppu_data
+                iny
+                cpy #palette_size
+                bne -
+                dex
+                bne --
+
+                lda (pointer),y         ; scroll values follow palette
+                sta hscroll
+                iny
+                lda (pointer),y
+                sta vscroll
+
+                ldy #$3f                ; this should avoid a glitch
+                lda #$00
+                jsr set_ppu_addr        ; Y*$100+A -> address
+                ldy #$00
+                lda #$00
+                jmp set_ppu_addr        ; Y*$100+A -> address
+
+show_image      ; enable rendering in the next VBlank
+
+                jsr wait_vbl_start      ; wait until next VBlank starts
+                lda #>oam_copy          ; do OAM DMA
+                sta oam_dma
+                lda hscroll
+                sta ppu_scroll
+                lda vscroll
+                sta ppu_scroll
+                ; enable NMI on VBlank; use 8*16-px sprites;
+                ; use PT0 for BG; use PT1 for sprites
+                lda #%10101000
+                sta ppu_ctrl
+                lda #%00011110          ; show background and sprites
+                sta ppu_mask
+                rts
+
+copy_to_ppu     ldy #0                  ; copy X pages from pointer to PPU;
+-               lda (pointer),y         ; advance pointer by X pages
+                sta ppu_data
+                iny
+                bne -
+                inc pointer+1
+                dex
+                bne -
+                rts
+
+switch_bank     tay                     ; switch PRG bank at $8000 to A
+                sta bank_table,y        ; (must write the same value)
+                rts
+
+read_joypad     ldx #$01                ; read first joypad to joypad_status
+                stx joypad1
+                dex
+                stx joypad1
+                ldx #8
+-               lda joypad1
+                lsr a
+                rol joypad_status
+                dex
+                bne -
+                rts
+
+wait_vbl_start  bit ppu_status          ; wait until next VBlank starts
+-               lda ppu_status
+                bpl -
+                rts
+
+set_ppu_addr    sty ppu_addr            ; Y*$100+A -> address
+                sta ppu_addr
+                rts
+
+nmi             pha                     ; NMI routine
+                bit ppu_status
+                lda #$00
+                sta oam_addr
+                lda #>oam_copy          ; do OAM DMA
+                sta oam_dma
+                lda #$80
+                sta nmi_done
+                pla
+irq             rti                     ; IRQ routine (unused)
+
+                pad $fffa, $ff          ; interrupt vectors (IRQ unused)
+                dw nmi, reset, irq
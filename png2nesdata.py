@@ -1,6 +1,6 @@
 # convert an image into NES graphics data
 
-import collections, itertools, os, sys, time
+import argparse, collections, hashlib, itertools, os, random, sys, time
 try:
     from PIL import Image
 except ImportError:
@@ -78,12 +78,32 @@ NES_PALETTE = {
 # files to write (used by stillimage.asm)
 PRG_OUT_FILE = "prg.bin"
 CHR_OUT_FILE = "chr.bin"
+# the order in which tiles were eliminated; can be replayed with --trace
+TRACE_OUT_FILE = "trace.txt"
+# files to write in gallery mode (used by gallery.asm)
+GALLERY_INC_OUT_FILE   = "gallery.inc"         # constants
+GALLERY_PRG_OUT_FILE   = "gallery-prg.bin"     # switchable PRG ROM banks
+GALLERY_TABLE_OUT_FILE = "gallery-tables.bin"  # where each image is
+
+# gallery ROM (UNROM mapper with 8 KiB of CHR RAM)
+PRG_BANK_SIZE      = 16 * 1024  # PRG ROM bank size in bytes
+CHR_SET_SIZE       =  8 * 1024  # size of pattern tables in bytes
+# PRG ROM banks, including the fixed one; iNES header limit; real UNROM
+# boards have 8 banks and UOROM boards 16
+MAX_PRG_BANKS      = 255
+MAX_REAL_PRG_BANKS = 16
+MAX_GALLERY_IMAGES = 256
+# distinct 8*16-pixel sprite tile pairs that fit in pattern table 1
+MAX_SPRITE_TILE_PAIRS = 128
 
 BLANK_TILE_INDEX = 0
 BLANK_TILE  = TILE_WIDTH * TILE_HEIGHT * (0,)  # filled with colour 0
 UNUSED_TILE = TILE_WIDTH * TILE_HEIGHT * (3,)  # filled with colour 3
 UNUSED_COLOUR = 0x00  # NES colour index
 
+# how many tiles --estimate compares to all others
+ESTIMATE_SAMPLE_SIZE = 16
+
 # --- read_image() and its functions ------------------------------------------
 
 def get_colour_diff(rgb1, rgb2):
@@ -180,6 +200,126 @@ def read_image(image):
 
     return (imgTiles, nesPalette, image.width // TILE_WIDTH)
 
+# --- vantage-point tree of tiles ---------------------------------------------
+
+def get_colour_diff_table(nesPalette):
+    # get differences of distinct colours in a palette
+    #   nesPalette: list of NES colour indexes
+    #   return:     {(colour1, colour2): difference, ...}; colour1 != colour2
+    return dict(
+        ((c1, c2), get_colour_diff(
+            NES_PALETTE[nesPalette[c1]], NES_PALETTE[nesPalette[c2]]
+        ))
+        for c1 in range(4) for c2 in range(4) if c1 != c2
+    )
+
+def get_colour_masks(tile):
+    # get a bitmask of pixels for each colour of a tile
+    #   tile:   tuple of (TILE_WIDTH * TILE_HEIGHT) 2-bit ints
+    #   return: tuple of 4 ints; bit N is set if pixel N has that colour
+    masks = [0, 0, 0, 0]
+    for (i, c) in enumerate(tile):
+        masks[c] |= 1 << i
+    return tuple(masks)
+
+def get_tile_diff_masked(masks1, masks2, colourDiffs):
+    # same result as get_tile_diff() but much faster
+    #   masks1, masks2: colour masks of tiles; see get_colour_masks()
+    #   colourDiffs:    see get_colour_diff_table()
+    return sum(
+        diff * (masks1[c1] & masks2[c2]).bit_count()
+        for ((c1, c2), diff) in colourDiffs.items()
+    )
+
+def build_vp_tree(tileInds, tileMasks, colourDiffs, nodePaths, path=()):
+    # build a vantage-point tree for finding the closest tile to another tile
+    # without comparing all tiles to each other
+    #   tileInds:    indexes to tileMasks to put in the tree
+    #   tileMasks:   colour masks of each tile; see get_colour_masks()
+    #   colourDiffs: see get_colour_diff_table()
+    #   nodePaths:   a dict to fill: {tile_index: nodes_from_root, ...}
+    #   path:        nodes from the root to the parent of this subtree
+    #   return:      the root node or None if there are no tiles;
+    #                a node is a list:
+    #                  [tile_index, radius, inside, outside, tiles_left];
+    #                  inside:     subtree of tiles at distance radius or less
+    #                  outside:    subtree of tiles at distance radius or more
+    #                  tiles_left: tiles in this subtree not removed yet
+
+    if not tileInds:
+        return None
+
+    # the tiles are sorted by distance from the parent's vantage point, if
+    # any; the last one is the farthest
+    vantage = tileInds[-1]
+    vantageMasks = tileMasks[vantage]
+    others = sorted(
+        (get_tile_diff_masked(vantageMasks, tileMasks[t], colourDiffs), t)
+        for t in tileInds[:-1]
+    )
+
+    # split at the median distance; equal distances may end up on both sides
+    half = len(others) // 2
+    radius = others[half][0] if others else 0
+
+    node = [vantage, radius, None, None, len(tileInds)]
+    nodePaths[vantage] = path + (node,)
+    node[2] = build_vp_tree(
+        [t for (d, t) in others[:half]], tileMasks, colourDiffs, nodePaths,
+        nodePaths[vantage]
+    )
+    node[3] = build_vp_tree(
+        [t for (d, t) in others[half:]], tileMasks, colourDiffs, nodePaths,
+        nodePaths[vantage]
+    )
+    return node
+
+def remove_from_vp_tree(nodePaths, tileInd):
+    # mark a tile as removed from a vantage-point tree
+    for node in nodePaths[tileInd]:
+        node[4] -= 1
+
+def find_closest_tile(
+    node, srcInd, tileMasks, colourDiffs, tilesLeft, best=(-1, -1)
+):
+    # find the closest tile that hasn't been removed from a vantage-point tree
+    #   node:        root of the tree
+    #   srcInd:      index of tile to find a match for; not a match itself
+    #   tileMasks:   colour masks of each tile; see get_colour_masks()
+    #   colourDiffs: see get_colour_diff_table()
+    #   tilesLeft:   set of tile indexes not removed from the tree
+    #   best:        the best match so far: (difference, index) or (-1, -1)
+    #   return:      (difference, index); on ties, the smallest index, just
+    #                like get_tile_to_replace()
+
+    if node is None or node[4] == 0:
+        return best
+    (vantage, radius, inside, outside) = node[:4]
+
+    diff = get_tile_diff_masked(
+        tileMasks[srcInd], tileMasks[vantage], colourDiffs
+    )
+    if (
+        vantage != srcInd and vantage in tilesLeft
+        and (best[0] == -1 or (diff, vantage) < best)
+    ):
+        best = (diff, vantage)
+
+    # search the more promising side first; by the triangle inequality, a
+    # side can be skipped if it can't contain a tile as close as the best one
+    # so far (equally close tiles must still be found for the tiebreak)
+    if diff <= radius:
+        subtrees = ((inside, diff - radius), (outside, radius - diff))
+    else:
+        subtrees = ((outside, radius - diff), (inside, diff - radius))
+    for (subtree, minDiff) in subtrees:
+        if best[0] == -1 or minDiff <= best[0]:
+            best = find_closest_tile(
+                subtree, srcInd, tileMasks, colourDiffs, tilesLeft, best
+            )
+
+    return best
+
 # --- eliminate_and_assign_tiles() and its functions --------------------------
 
 def get_tile_diff(tile1, tile2, nesPalette):
@@ -292,25 +432,41 @@ def get_tile_diff(tile1, tile2, nesPalette):
         ) for (c1, c2) in zip(tile1, tile2)
     )
 
-def eliminate_tiles(
-    origDistinctImgTiles, origImgTileIndexes, imgWidth, nesPalette
+def get_distinct_bg_tile_count(imgTileIndexes, imgWidth, imgHeight):
+    # how many distinct background tiles would the image need?
+    #   imgTileIndexes: list of image tile indexes starting from top left, with
+    #                   duplicates
+    #   imgWidth:       image width  in tiles
+    #   imgHeight:      image height in tiles
+    spriteCnt = len(list(
+        assign_tiles_to_sprites(imgTileIndexes, imgWidth, imgHeight)
+    ))
+    return (
+        len(set(imgTileIndexes) | set((BLANK_TILE_INDEX,))) - spriteCnt * 2
+    )
+
+def merge_tiles(imgTileIndexes, tileFrom, tileTo):
+    # replace a tile with another one in each tile position; return new list
+    return [(tileTo if i == tileFrom else i) for i in imgTileIndexes]
+
+def generate_merges(
+    origDistinctImgTiles, origImgTileIndexes, nesPalette, mergeTrace,
+    useIndex=False
 ):
-    # if there are too many distinct tiles in the image, eliminate them
-    #   origDistinctImgTiles: pixels of each originally distinct tile;
-    #                         does not change
+    # generate tile merges in the order eliminate_tiles() uses them until only
+    # the blank tile is left; the order only depends on the image, not on how
+    # many tiles we need to eliminate
+    #   origDistinctImgTiles: pixels of each originally distinct tile
     #   origImgTileIndexes:   which tile index was originally in each tile
-    #                         position; does not change
-    #   imgWidth:             image width in tiles
+    #                         position
     #   nesPalette:           list of NES colour indexes
-    #   return:               new tile indexes in each tile position
-
-    imgHeight = len(origImgTileIndexes) // imgWidth  # image height in tiles
-
-    # a table of differences between any two tiles; does not change
-    origTileDiffs = []
-    for tile1 in origDistinctImgTiles:
-        for tile2 in origDistinctImgTiles:
-            origTileDiffs.append(get_tile_diff(tile1, tile2, nesPalette))
+    #   mergeTrace:           merges from an earlier run; replayed first, then
+    #                         new merges are computed and appended to it;
+    #                         see read_merge_trace()
+    #   useIndex:             use search_merges_with_index() instead of a
+    #                         table of differences between all tiles
+    #   generate:             (tile_from, tile_to, total_error) per call;
+    #                           total_error: see eliminate_and_assign_tiles()
 
     # which tile index is in each tile position; updated whenever a tile is
     # eliminated
@@ -320,46 +476,172 @@ def eliminate_tiles(
     # eliminated yet
     distinctImgTilesLeft = set(range(len(origDistinctImgTiles)))
 
+    # replaying is cheap: no need to compare tiles;
+    # remember how many times each eliminated tile was used
+    fromCnts = []
+    for (tileFrom, tileTo, totalError) in mergeTrace:
+        fromCnts.append(imgTileIndexes.count(tileFrom))
+        imgTileIndexes = merge_tiles(imgTileIndexes, tileFrom, tileTo)
+        distinctImgTilesLeft.remove(tileFrom)
+        yield (tileFrom, tileTo, totalError)
+
+    if len(distinctImgTilesLeft) == 1:
+        return
+    if useIndex:
+        yield from search_merges_with_index(
+            origDistinctImgTiles, origImgTileIndexes, nesPalette, mergeTrace,
+            imgTileIndexes, distinctImgTilesLeft
+        )
+        return
+
+    # a table of differences between any two tiles; does not change
+    origTileDiffs = []
+    for tile1 in origDistinctImgTiles:
+        for tile2 in origDistinctImgTiles:
+            origTileDiffs.append(get_tile_diff(tile1, tile2, nesPalette))
+    origTileCnt = len(origDistinctImgTiles)
+
     # the smallest possible error on each round of tile elimination;
     # it never decreases, so it lets us stop searching early for a ~30% speedup
     # and no loss of quality
-    minPossibleError = 1
+    minPossibleError = max(
+        [1] + [
+            origTileDiffs[tileFrom*origTileCnt+tileTo] * fromCnt
+            for ((tileFrom, tileTo, e), fromCnt) in zip(mergeTrace, fromCnts)
+        ]
+    )
+    totalError = mergeTrace[-1][2] if mergeTrace else 0
+
+    while len(distinctImgTilesLeft) > 1:
+        # replace a tile with one that will cause the smallest total error
+        (tileFrom, tileTo) = get_tile_to_replace(
+            origTileCnt,
+            origTileDiffs,
+            collections.Counter(imgTileIndexes),
+            distinctImgTilesLeft,
+            minPossibleError
+        )
+        minPossibleError = max(
+            minPossibleError,
+            origTileDiffs[tileFrom*origTileCnt+tileTo]
+            * imgTileIndexes.count(tileFrom)
+        )
 
-    while True:
-        # get number of distinct background tiles
-        spriteCnt = len(list(
-            assign_tiles_to_sprites(imgTileIndexes, imgWidth, imgHeight)
-        ))
-        distinctBgTileCnt = (
-            len(set(imgTileIndexes) | set((BLANK_TILE_INDEX,))) - spriteCnt * 2
+        # the error compared to the original image changes only in the
+        # positions being replaced
+        totalError += sum(
+              origTileDiffs[o*origTileCnt+tileTo]
+            - origTileDiffs[o*origTileCnt+tileFrom]
+            for (o, i) in zip(origImgTileIndexes, imgTileIndexes)
+            if i == tileFrom
         )
 
-        if distinctBgTileCnt <= MAX_BG_TILES:
-            break
-        else:
-            # replace a tile with one that will cause the smallest total error
-            (tileFrom, tileTo) = get_tile_to_replace(
-                len(origDistinctImgTiles),
-                origTileDiffs,
-                collections.Counter(imgTileIndexes),
-                distinctImgTilesLeft,
-                minPossibleError
-            )
-            minPossibleError = max(
-                minPossibleError,
-                origTileDiffs[tileFrom*len(origDistinctImgTiles)+tileTo]
-                * imgTileIndexes.count(tileFrom)
-            )
+        imgTileIndexes = merge_tiles(imgTileIndexes, tileFrom, tileTo)
+        distinctImgTilesLeft.remove(tileFrom)
+        mergeTrace.append((tileFrom, tileTo, totalError))
+        yield (tileFrom, tileTo, totalError)
+
+def search_merges_with_index(
+    origDistinctImgTiles, origImgTileIndexes, nesPalette, mergeTrace,
+    imgTileIndexes, distinctImgTilesLeft
+):
+    # the rest of generate_merges() using a vantage-point tree instead of a
+    # table of differences between all tiles; uses much less memory and gives
+    # the same merges
+    #   imgTileIndexes:       which tile index is in each tile position after
+    #                         replaying mergeTrace
+    #   distinctImgTilesLeft: set of tile indexes not eliminated yet
+    #   others:               see generate_merges()
+
+    colourDiffs = get_colour_diff_table(nesPalette)
+    tileMasks = [get_colour_masks(t) for t in origDistinctImgTiles]
+
+    nodePaths = {}
+    root = build_vp_tree(
+        list(range(len(origDistinctImgTiles))), tileMasks, colourDiffs,
+        nodePaths
+    )
+    for tileInd in set(nodePaths) - distinctImgTilesLeft:
+        remove_from_vp_tree(nodePaths, tileInd)
+
+    # {tile_index: (difference, closest_tile_index), ...} for each tile that
+    # can be eliminated; only updated when the closest tile is eliminated
+    closestTiles = dict(
+        (i, find_closest_tile(
+            root, i, tileMasks, colourDiffs, distinctImgTilesLeft
+        )) for i in distinctImgTilesLeft if i != BLANK_TILE_INDEX
+    )
+    tileCnts = collections.Counter(imgTileIndexes)
+    totalError = mergeTrace[-1][2] if mergeTrace else 0
+
+    while len(distinctImgTilesLeft) > 1:
+        # replace a tile with one that will cause the smallest total error;
+        # on ties, prefer the smallest index like get_tile_to_replace()
+        tileFrom = min(
+            closestTiles,
+            key=lambda i: (closestTiles[i][0] * tileCnts[i], i)
+        )
+        tileTo = closestTiles[tileFrom][1]
+
+        # the error compared to the original image changes only in the
+        # positions being replaced
+        (fromMasks, toMasks) = (tileMasks[tileFrom], tileMasks[tileTo])
+        totalError += sum(
+              get_tile_diff_masked(tileMasks[o], toMasks,   colourDiffs)
+            - get_tile_diff_masked(tileMasks[o], fromMasks, colourDiffs)
+            for (o, i) in zip(origImgTileIndexes, imgTileIndexes)
+            if i == tileFrom
+        )
+
+        imgTileIndexes = merge_tiles(imgTileIndexes, tileFrom, tileTo)
+        tileCnts[tileTo] += tileCnts.pop(tileFrom)
+        distinctImgTilesLeft.remove(tileFrom)
+        remove_from_vp_tree(nodePaths, tileFrom)
+        del closestTiles[tileFrom]
+
+        for i in closestTiles:
+            if closestTiles[i][1] == tileFrom:
+                closestTiles[i] = find_closest_tile(
+                    root, i, tileMasks, colourDiffs, distinctImgTilesLeft
+                )
+
+        mergeTrace.append((tileFrom, tileTo, totalError))
+        yield (tileFrom, tileTo, totalError)
+
+def eliminate_tiles(
+    origDistinctImgTiles, origImgTileIndexes, imgWidth, nesPalette,
+    maxBgTiles, mergeTrace, useIndex
+):
+    # if there are too many distinct tiles in the image, eliminate them
+    #   origDistinctImgTiles: pixels of each originally distinct tile;
+    #                         does not change
+    #   origImgTileIndexes:   which tile index was originally in each tile
+    #                         position; does not change
+    #   imgWidth:             image width in tiles
+    #   nesPalette:           list of NES colour indexes
+    #   maxBgTiles:           maximum number of distinct background tiles
+    #   mergeTrace, useIndex: see generate_merges()
+    #   return:               new tile indexes in each tile position
 
-            imgTileIndexes = [
-                (tileTo if i == tileFrom else i) for i in imgTileIndexes
-            ]
-            distinctImgTilesLeft.remove(tileFrom)
+    imgHeight = len(origImgTileIndexes) // imgWidth  # image height in tiles
+
+    merges = generate_merges(
+        origDistinctImgTiles, origImgTileIndexes, nesPalette, mergeTrace,
+        useIndex
+    )
+    imgTileIndexes = origImgTileIndexes.copy()
+    while (
+        get_distinct_bg_tile_count(imgTileIndexes, imgWidth, imgHeight)
+        > maxBgTiles
+    ):
+        (tileFrom, tileTo, totalError) = next(merges)
+        imgTileIndexes = merge_tiles(imgTileIndexes, tileFrom, tileTo)
 
     return imgTileIndexes
 
 def eliminate_and_assign_tiles(
-    origDistinctImgTiles, imgTiles, imgWidth, nesPalette
+    origDistinctImgTiles, imgTiles, imgWidth, nesPalette, maxBgTiles,
+    mergeTrace, useIndex
 ):
     # eliminate distinct tiles if necessary and assign tiles to background and
     # sprites
@@ -367,6 +649,8 @@ def eliminate_and_assign_tiles(
     #   imgTiles:             pixels of each tile with duplicates
     #   imgWidth:             image width in tiles
     #   nesPalette:           list of NES colour indexes
+    #   maxBgTiles:           maximum number of distinct background tiles
+    #   mergeTrace, useIndex: see generate_merges()
     #   return:               (background_tile_indexes, sprite_data,
     #                         total_error);
     #                           sprite_data: [(x, y, i1, i2), ...]
@@ -379,7 +663,8 @@ def eliminate_and_assign_tiles(
 
     # eliminate distinct tiles if necessary
     imgTileIndexes = eliminate_tiles(
-        origDistinctImgTiles, origImgTileIndexes, imgWidth, nesPalette
+        origDistinctImgTiles, origImgTileIndexes, imgWidth, nesPalette,
+        maxBgTiles, mergeTrace, useIndex
     )
 
     # reassign as many tiles as possible to sprites
@@ -395,7 +680,7 @@ def eliminate_and_assign_tiles(
 
     distinctBgTileIndexes = set(bgTileIndexes) | set((BLANK_TILE_INDEX,))
     if (
-           len(distinctBgTileIndexes) > MAX_BG_TILES
+           len(distinctBgTileIndexes) > maxBgTiles
         or len(spriteData)            > MAX_SPRITES
     ):
         sys.exit("Error: crosscheck #1 failed (this should never happen).")
@@ -409,6 +694,228 @@ def eliminate_and_assign_tiles(
 
     return (bgTileIndexes, spriteData, totalError)
 
+# --- estimate_elimination() and its functions --------------------------------
+
+def predict_index_time(
+    origDistinctImgTiles, tileMasks, colourDiffs, sample, elimCnt, roundTime
+):
+    # predict the time search_merges_with_index() and eliminate_tiles() take
+    #   sample:    indexes of tiles to time searches for
+    #   roundTime: time of one get_distinct_bg_tile_count() call
+    #   others:    see estimate_elimination() and search_merges_with_index()
+    #   return:    float; in seconds
+
+    distinctTileCnt = len(origDistinctImgTiles)
+
+    # building the tree is cheap enough to just do it
+    buildStartTime = time.perf_counter()
+    root = build_vp_tree(
+        list(range(distinctTileCnt)), tileMasks, colourDiffs, {}
+    )
+    buildTime = time.perf_counter() - buildStartTime
+
+    # time a few searches
+    tilesLeft = set(range(distinctTileCnt))
+    searchStartTime = time.perf_counter()
+    for tileInd in sample:
+        find_closest_tile(root, tileInd, tileMasks, colourDiffs, tilesLeft)
+    searchTime = (time.perf_counter() - searchStartTime) / len(sample)
+
+    # the tree and a search for every tile, then a few passes over the image
+    # and a couple of new searches per round
+    return (
+        buildTime + distinctTileCnt * searchTime
+        + elimCnt * (roundTime * 4 + searchTime * 2)
+    )
+
+def estimate_elimination(
+    origDistinctImgTiles, imgTiles, imgWidth, nesPalette, maxBgTiles,
+    useIndex
+):
+    # quickly estimate what eliminate_tiles() would do without running it
+    #   origDistinctImgTiles: pixels of each originally distinct tile
+    #   imgTiles:             pixels of each tile with duplicates
+    #   imgWidth:             image width in tiles
+    #   nesPalette:           list of NES colour indexes
+    #   maxBgTiles:           maximum number of distinct background tiles
+    #   useIndex:             predict the time of the vantage-point tree
+    #                         search instead of the table of differences
+    #   return:               (tiles_to_eliminate, predicted_time,
+    #                         predicted_error);
+    #                           tiles_to_eliminate: int; a lower limit
+    #                           predicted_time:     float; in seconds
+    #                           predicted_error:    int; see
+    #                             eliminate_and_assign_tiles()
+
+    imgHeight = len(imgTiles) // imgWidth
+    distinctTileCnt = len(origDistinctImgTiles)
+
+    tileToIndex = dict((t, i) for (i, t) in enumerate(origDistinctImgTiles))
+    origImgTileIndexes = [tileToIndex[t] for t in imgTiles]
+
+    # same as the first round of eliminate_tiles(); eliminating tiles may make
+    # some sprite tiles non-unique, so more tiles may have to go in the end
+    assignStartTime = time.perf_counter()
+    distinctBgTileCnt = get_distinct_bg_tile_count(
+        origImgTileIndexes, imgWidth, imgHeight
+    )
+    roundTime = time.perf_counter() - assignStartTime
+    elimCnt = max(distinctBgTileCnt - maxBgTiles, 0)
+    if elimCnt == 0:
+        return (0, 0.0, 0)
+
+    tileCnts = collections.Counter(origImgTileIndexes)
+    colourDiffs = get_colour_diff_table(nesPalette)
+    tileMasks = [get_colour_masks(t) for t in origDistinctImgTiles]
+
+    # get (distance_to_closest_tile * tile_count) for a random sample of tiles;
+    # that's what get_tile_to_replace() minimises
+    candidates = [i for i in range(distinctTileCnt) if i != BLANK_TILE_INDEX]
+    sample = random.Random(0).sample(
+        candidates, min(ESTIMATE_SAMPLE_SIZE, len(candidates))
+    )
+    sampleErrors = sorted(
+        min(
+            get_tile_diff_masked(
+                tileMasks[srcInd], tileMasks[dstInd], colourDiffs
+            ) for dstInd in range(distinctTileCnt) if dstInd != srcInd
+        ) * tileCnts[srcInd]
+        for srcInd in sample
+    )
+
+    # the cheapest tiles go first; sum the cheapest part of the sample and
+    # scale it up to all tiles
+    sampleElimCnt = min(elimCnt * len(sample) / len(candidates), len(sample))
+    wholeCnt = int(sampleElimCnt)
+    predictedError = sum(sampleErrors[:wholeCnt])
+    if wholeCnt < len(sample):
+        predictedError += (sampleElimCnt - wholeCnt) * sampleErrors[wholeCnt]
+    predictedError = round(predictedError * len(candidates) / len(sample))
+
+    if useIndex:
+        return (elimCnt, predict_index_time(
+            origDistinctImgTiles, tileMasks, colourDiffs, sample, elimCnt,
+            roundTime
+        ), predictedError)
+
+    # time a few tile comparisons the way eliminate_tiles() does them
+    diffStartTime = time.perf_counter()
+    for tile in origDistinctImgTiles[:ESTIMATE_SAMPLE_SIZE]:
+        get_tile_diff(origDistinctImgTiles[sample[0]], tile, nesPalette)
+    diffTime = (time.perf_counter() - diffStartTime) / min(
+        ESTIMATE_SAMPLE_SIZE, distinctTileCnt
+    )
+
+    # time the search in get_tile_to_replace() in a small table without early
+    # exits
+    searchSize = min(ESTIMATE_SAMPLE_SIZE * 4, distinctTileCnt)
+    searchStartTime = time.perf_counter()
+    get_tile_to_replace(
+        searchSize,
+        searchSize ** 2 * [1],
+        collections.Counter(range(searchSize)),
+        set(range(searchSize)),
+        0
+    )
+    pairTime = (time.perf_counter() - searchStartTime) / searchSize ** 2
+
+    # difference table, then one search and a few passes over the image per
+    # round; the search exits early on ~30% of the rounds
+    predictedTime = (
+        distinctTileCnt ** 2 * diffTime
+        + 0.7 * pairTime * sum(
+            (distinctTileCnt - i) ** 2 for i in range(elimCnt)
+        )
+        + elimCnt * roundTime * 4
+    )
+
+    return (elimCnt, predictedTime, predictedError)
+
+# --- merge traces ------------------------------------------------------------
+
+def get_image_id(
+    origDistinctImgTiles, origImgTileIndexes, imgWidth, nesPalette
+):
+    # identify the image a merge trace belongs to; the merges and their errors
+    # depend on the distinct tiles, how many times each of them occurs (i.e.
+    # the tile in each position) and the palette
+    #   origDistinctImgTiles: pixels of each originally distinct tile
+    #   origImgTileIndexes:   which tile index was originally in each tile
+    #                         position
+    #   imgWidth:             image width in tiles
+    #   nesPalette:           NES colours of the image
+    #   return:               hex string
+    return hashlib.sha1(bytes(itertools.chain(
+        nesPalette, (imgWidth,), *origDistinctImgTiles,
+        *(i.to_bytes(2, "big") for i in origImgTileIndexes)
+    ))).hexdigest()
+
+def read_merge_trace(handle, imageId, distinctTileCnt):
+    # read a merge trace written by write_merge_trace()
+    #   handle:          file opened in text mode
+    #   imageId:         see get_image_id()
+    #   distinctTileCnt: number of originally distinct tiles
+    #   return:          [(tile_from, tile_to, total_error), ...]
+
+    lines = handle.read().splitlines()
+    if not lines or lines[0] != f"image {imageId}":
+        sys.exit("The merge trace was written for another image.")
+
+    mergeTrace = []
+    distinctTilesLeft = set(range(distinctTileCnt))
+    for line in lines[1:]:
+        try:
+            (tileFrom, tileTo, totalError) = (int(n) for n in line.split())
+        except ValueError:
+            sys.exit("Invalid merge trace.")
+        if (
+               tileFrom == BLANK_TILE_INDEX
+            or tileFrom == tileTo
+            or tileFrom not in distinctTilesLeft
+            or tileTo   not in distinctTilesLeft
+        ):
+            sys.exit("Invalid merge trace.")
+        distinctTilesLeft.remove(tileFrom)
+        mergeTrace.append((tileFrom, tileTo, totalError))
+
+    return mergeTrace
+
+def write_merge_trace(handle, imageId, mergeTrace):
+    # write a merge trace; one line per merge: tile_from tile_to total_error
+    #   handle:     file opened in text mode
+    #   imageId:    see get_image_id()
+    #   mergeTrace: see generate_merges()
+    handle.write(f"image {imageId}\n")
+    for (tileFrom, tileTo, totalError) in mergeTrace:
+        handle.write(f"{tileFrom} {tileTo} {totalError}\n")
+
+def get_budget_sweep(origImgTileIndexes, imgWidth, mergeTrace):
+    # replay a merge trace to see how much quality each tile budget costs
+    #   origImgTileIndexes: which tile index was originally in each tile
+    #                       position
+    #   imgWidth:           image width in tiles
+    #   mergeTrace:         see generate_merges()
+    #   generate:           (distinct_bg_tile_count, total_error) whenever
+    #                       the number of distinct background tiles hits a new
+    #                       low
+
+    imgHeight = len(origImgTileIndexes) // imgWidth
+
+    imgTileIndexes = origImgTileIndexes.copy()
+    minTileCnt = get_distinct_bg_tile_count(
+        imgTileIndexes, imgWidth, imgHeight
+    )
+    yield (minTileCnt, 0)
+
+    for (tileFrom, tileTo, totalError) in mergeTrace:
+        imgTileIndexes = merge_tiles(imgTileIndexes, tileFrom, tileTo)
+        tileCnt = get_distinct_bg_tile_count(
+            imgTileIndexes, imgWidth, imgHeight
+        )
+        if tileCnt < minTileCnt:
+            minTileCnt = tileCnt
+            yield (tileCnt, totalError)
+
 # -----------------------------------------------------------------------------
 
 def process_background_data(origDistinctImgTiles, bgTileIndexes):
@@ -526,6 +1033,43 @@ def get_spr_tile_pair_index(upperTile1, lowerTile1, tilePairs):
 
     sys.exit("Error: crosscheck #2 failed (this should never happen).")
 
+def index_sprite_tile_pairs(tilePairs):
+    # same as deduplicate_sprite_tile_pairs() and get_spr_tile_pair_index()
+    # but flips each pair only once, so much faster for many sprites
+    #   tilePairs: list of distinct (tile1, tile2);
+    #              a tile is a list of (TILE_WIDTH * TILE_HEIGHT) 2-bit ints
+    #   return:    (distinct_tile_pairs, pair_to_index);
+    #                distinct_tile_pairs: tile pairs without flipwise
+    #                  duplicates
+    #                pair_to_index: {(tile1, tile2): (index_to_distinct_
+    #                  tile_pairs, h_flip, v_flip), ...} for each pair and its
+    #                  flips
+
+    distinctTilePairs = []
+    pairToIndex = {}
+    for (upperTile, lowerTile) in tilePairs:
+        # a flip of an earlier pair if its flips were indexed already
+        if (upperTile, lowerTile) in pairToIndex:
+            continue
+        ind = len(distinctTilePairs)
+        distinctTilePairs.append((upperTile, lowerTile))
+        # if several flips are equal, prefer them in the same order as
+        # get_spr_tile_pair_index()
+        for (flippedPair, hFlip, vFlip) in (
+            ((upperTile, lowerTile), 0, 0),
+            ((tile_hflip(upperTile), tile_hflip(lowerTile)), 1, 0),
+            ((tile_vflip(lowerTile), tile_vflip(upperTile)), 0, 1),
+            (
+                (
+                    tile_hflip(tile_vflip(lowerTile)),
+                    tile_hflip(tile_vflip(upperTile))
+                ), 1, 1
+            ),
+        ):
+            pairToIndex.setdefault(flippedPair, (ind, hFlip, vFlip))
+
+    return (distinctTilePairs, pairToIndex)
+
 def process_sprite_data(distinctImgTiles, spriteData):
     # convert sprites to flipwise-deduplicated tile pairs
     #   distinctImgTiles: pixels of each distinct tile in the original image
@@ -628,12 +1172,13 @@ def get_prg_data(ntData, spriteData, nesPalette, imgWidth):
     # horizontal and vertical background scroll
     yield from (xOffset, yOffset)
 
-def get_output_tiles(bgTiles, sprTilePairs):
+def get_output_tiles(bgTiles, sprTilePairs, maxSprTilePairs=MAX_SPRITES):
     # combine and pad background and sprite tiles;
     # a tile is a tuple of (TILE_WIDTH * TILE_HEIGHT) 2-bit ints
-    #   bgTiles:      list of distinct           background tiles
-    #   sprTilePairs: list of distinct tuples of sprite     tiles
-    #   generate:     (MAX_BG_TILES + MAX_SPRITES * 2) tiles
+    #   bgTiles:         list of distinct           background tiles
+    #   sprTilePairs:    list of distinct tuples of sprite     tiles
+    #   maxSprTilePairs: how many sprite tile pairs to pad to
+    #   generate:        (MAX_BG_TILES + maxSprTilePairs * 2) tiles
 
     yield from bgTiles
     yield from (
@@ -641,7 +1186,7 @@ def get_output_tiles(bgTiles, sprTilePairs):
     )
     yield from itertools.chain.from_iterable(sprTilePairs)
     yield from (
-        UNUSED_TILE for i in range((MAX_SPRITES - len(sprTilePairs)) * 2)
+        UNUSED_TILE for i in range((maxSprTilePairs - len(sprTilePairs)) * 2)
     )
 
 def encode_tile(tile):
@@ -656,46 +1201,477 @@ def encode_tile(tile):
                 for x in range(TILE_WIDTH)
             )
 
+# --- gallery mode ------------------------------------------------------------
+
+def group_gallery_images(imgTileSets, maxBgTiles):
+    # group images so that each group fits in one set of pattern tables and
+    # as few tiles as possible are stored; the images already fit in a set of
+    # their own, so no more tiles need to be eliminated
+    #   imgTileSets: for each image: (background_tiles, sprite_tile_pairs);
+    #                  both are sets; a tile is a tuple of pixels
+    #   maxBgTiles:  maximum number of distinct background tiles in a group
+    #   return:      list of lists of image indexes
+
+    # each group: [image_indexes, background_tiles, sprite_tile_pairs]
+    groups = []
+
+    # largest images first; add each image to the group where it needs the
+    # fewest new tiles, or to a new group if it doesn't fit anywhere
+    imgInds = sorted(
+        range(len(imgTileSets)),
+        key=lambda i: -(len(imgTileSets[i][0]) + len(imgTileSets[i][1]) * 2)
+    )
+    for imgInd in imgInds:
+        (bgTiles, sprTilePairs) = imgTileSets[imgInd]
+        bestGroup = None
+        minNewTileCnt = -1
+        for group in groups:
+            newBgTileCnt = len(bgTiles - group[1])
+            newSprTilePairCnt = len(sprTilePairs - group[2])
+            if (
+                    len(group[1]) + newBgTileCnt      <= maxBgTiles
+                and len(group[2]) + newSprTilePairCnt <= MAX_SPRITE_TILE_PAIRS
+            ):
+                newTileCnt = newBgTileCnt + newSprTilePairCnt * 2
+                if minNewTileCnt == -1 or newTileCnt < minNewTileCnt:
+                    minNewTileCnt = newTileCnt
+                    bestGroup = group
+        if bestGroup is None:
+            groups.append([[imgInd], set(bgTiles), set(sprTilePairs)])
+        else:
+            bestGroup[0].append(imgInd)
+            bestGroup[1].update(bgTiles)
+            bestGroup[2].update(sprTilePairs)
+
+    # in order of first image, so the first image shown is in group 0
+    return sorted(sorted(group[0]) for group in groups)
+
+def get_gallery_chr_set(bgTiles, sprTilePairs):
+    # sort and deduplicate the tiles of a group of images like
+    # process_background_data() and process_sprite_data() do
+    #   bgTiles:      set of background tiles
+    #   sprTilePairs: set of sprite tile pairs
+    #   return:       (distinct_background_tiles, distinct_sprite_tile_pairs,
+    #                 sprite_tile_pair_to_index); see
+    #                 index_sprite_tile_pairs()
+
+    distinctBgTiles = sorted(bgTiles | set((BLANK_TILE,)))
+    distinctBgTiles.sort(key=lambda t: len(set(t)))
+
+    distinctTilePairs = sorted(sprTilePairs)
+    distinctTilePairs.sort(key=lambda p: len(set(p[0]) | set(p[1])))
+
+    return (distinctBgTiles,) + index_sprite_tile_pairs(distinctTilePairs)
+
+def get_gallery_prg_data(
+    bgTiles, sprites, nesPalette, imgWidth, distinctBgTiles, sprPairToIndex
+):
+    # get PRG data of one image in a gallery; see get_prg_data()
+    #   bgTiles:         pixels of each background tile
+    #   sprites:         [(x, y, upper_tile, lower_tile), ...]; tiles are
+    #                    pixels
+    #   nesPalette:      list of NES colour indexes
+    #   imgWidth:        image width in tiles
+    #   distinctBgTiles: background tiles of the group of images
+    #   sprPairToIndex:  sprite tile pairs of the group of images; see
+    #                    index_sprite_tile_pairs()
+    #   return:          bytes
+
+    bgTileToIndex = dict((t, i) for (i, t) in enumerate(distinctBgTiles))
+    spriteData = [
+        (x, y) + sprPairToIndex[(upperTile, lowerTile)]
+        for (x, y, upperTile, lowerTile) in sprites
+    ]
+    spriteData.sort(key=lambda s: (s[1], s[0]))
+
+    return bytes(get_prg_data(
+        [bgTileToIndex[t] for t in bgTiles], spriteData, nesPalette, imgWidth
+    ))
+
+def add_to_prg_banks(prgBanks, data):
+    # add data to the first PRG ROM bank it fits in, or to a new bank
+    #   prgBanks: list of bytearrays
+    #   data:     bytes; at most PRG_BANK_SIZE
+    #   return:   (bank, CPU_address)
+
+    bank = next(
+        (
+            i for (i, bankData) in enumerate(prgBanks)
+            if len(bankData) + len(data) <= PRG_BANK_SIZE
+        ),
+        len(prgBanks)
+    )
+    if bank == len(prgBanks):
+        prgBanks.append(bytearray())
+    address = 0x8000 + len(prgBanks[bank])
+    prgBanks[bank].extend(data)
+    return (bank, address)
+
+def get_gallery_data(images, groups):
+    # get PRG ROM data for gallery.asm
+    #   images: for each image: (background_tiles, sprites, nes_palette,
+    #           image_width); see get_gallery_prg_data()
+    #   groups: from group_gallery_images()
+    #   return: (prg_banks, tables, chr_tile_count);
+    #             prg_banks:      list of bytearrays; CHR sets and image data
+    #                             (see get_prg_data())
+    #             tables:         bytes; for each image: PRG bank, address low
+    #                             byte, address high byte, CHR set, CHR PRG
+    #                             bank, CHR address low byte, CHR address high
+    #                             byte; each table has one byte per image
+    #             chr_tile_count: number of tiles stored in CHR sets
+
+    prgBanks = []
+    tables = [len(images) * [0] for i in range(7)]
+    chrTileCnt = 0
+
+    # CHR sets first, so two of them fill each bank; then image data in the
+    # first bank with room for it (it needn't be in the bank of its CHR set)
+    chrSets = []
+    for group in groups:
+        (distinctBgTiles, sprTilePairs, sprPairToIndex) = get_gallery_chr_set(
+            set(itertools.chain.from_iterable(images[i][0] for i in group)),
+            set(
+                (upperTile, lowerTile) for i in group
+                for (x, y, upperTile, lowerTile) in images[i][1]
+            )
+        )
+        chrTileCnt += len(distinctBgTiles) + len(sprTilePairs) * 2
+
+        chrSets.append((distinctBgTiles, sprPairToIndex) + add_to_prg_banks(
+            prgBanks, bytes(itertools.chain.from_iterable(
+                encode_tile(t) for t in get_output_tiles(
+                    distinctBgTiles, sprTilePairs, MAX_SPRITE_TILE_PAIRS
+                )
+            ))
+        ))
+
+    for (groupInd, group) in enumerate(groups):
+        (distinctBgTiles, sprPairToIndex, chrBank, chrAddr) = (
+            chrSets[groupInd]
+        )
+        for imgInd in group:
+            (bgTiles, sprites, nesPalette, imgWidth) = images[imgInd]
+            (imgBank, imgAddr) = add_to_prg_banks(
+                prgBanks, get_gallery_prg_data(
+                    bgTiles, sprites, nesPalette, imgWidth, distinctBgTiles,
+                    sprPairToIndex
+                )
+            )
+            for (table, value) in zip(tables, (
+                imgBank, imgAddr & 0xff, imgAddr >> 8, groupInd,
+                chrBank, chrAddr & 0xff, chrAddr >> 8
+            )):
+                table[imgInd] = value
+
+    return (prgBanks, bytes(itertools.chain.from_iterable(tables)), chrTileCnt)
+
 # -----------------------------------------------------------------------------
 
-def main():
-    startTime = time.time()
+def parse_arguments():
+    # parse command line arguments
+
+    parser = argparse.ArgumentParser(
+        description="Converts an image into NES graphics data. See README.md "
+        "for details."
+    )
+    parser.add_argument(
+        "-e", "--estimate", action="store_true",
+        help="Only estimate how many tiles must be eliminated and how long "
+        "that takes. Don't write any files."
+    )
+    parser.add_argument(
+        "-b", "--max-bg-tiles", type=int,
+        help=f"Maximum number of distinct background tiles (1-{MAX_BG_TILES}, "
+        f"default {MAX_BG_TILES}). Use a smaller value to leave room for "
+        "other graphics."
+    )
+    parser.add_argument(
+        "-t", "--trace",
+        help=f"Merge trace written by an earlier run for the same image (see "
+        f"{TRACE_OUT_FILE}). Tiles are eliminated in the same order without "
+        "searching for them again as far as the trace goes."
+    )
+    parser.add_argument(
+        "-s", "--budget-sweep", action="store_true",
+        help="Eliminate all tiles, print quality loss for each number of "
+        f"distinct background tiles and write {TRACE_OUT_FILE}. Don't write "
+        "other files."
+    )
+    parser.add_argument(
+        "-i", "--index", action="store_true",
+        help="Find similar tiles using a vantage-point tree instead of a "
+        "table of differences between all tiles. Uses much less memory. The "
+        "result is the same."
+    )
+    parser.add_argument(
+        "-g", "--gallery", action="store_true",
+        help="Convert several images into data for gallery.asm instead. Tiles "
+        "are shared between images where possible."
+    )
+    parser.add_argument(
+        "input_files", nargs="+", metavar="input_file",
+        help="Image file to read. In gallery mode, 1-"
+        f"{MAX_GALLERY_IMAGES} files in the order they will be shown."
+    )
+    args = parser.parse_args()
 
-    # parse command line argument
-    if len(sys.argv) != 2:
+    if args.gallery:
+        if args.estimate or args.trace is not None or args.budget_sweep:
+            sys.exit(
+                "--estimate, --trace and --budget-sweep can't be used with "
+                "--gallery."
+            )
+        if len(args.input_files) > MAX_GALLERY_IMAGES:
+            sys.exit(
+                f"A gallery can have at most {MAX_GALLERY_IMAGES} images."
+            )
+    elif len(args.input_files) > 1:
+        sys.exit("Only one input file allowed without --gallery.")
+
+    if args.estimate and (args.trace is not None or args.budget_sweep):
+        sys.exit("--trace and --budget-sweep can't be used with --estimate.")
+    if args.budget_sweep and args.max_bg_tiles is not None:
         sys.exit(
-            "Converts an image into NES graphics data. Argument: input file. "
-            "See README.md for details."
+            "--max-bg-tiles can't be used with --budget-sweep; the sweep "
+            "covers all numbers of tiles."
         )
-    inputFile = sys.argv[1]
-    if not os.path.isfile(inputFile):
-        sys.exit("Input file not found.")
 
-    # read input file
+    if args.max_bg_tiles is None:
+        args.max_bg_tiles = MAX_BG_TILES
+    elif not 1 <= args.max_bg_tiles <= MAX_BG_TILES:
+        sys.exit(
+            f"Maximum number of background tiles must be 1-{MAX_BG_TILES}."
+        )
+    if args.trace is not None and not os.path.isfile(args.trace):
+        sys.exit("Merge trace file not found.")
+
+    return args
+
+def write_trace_file(imageId, mergeTrace):
+    # write TRACE_OUT_FILE; see write_merge_trace()
+    try:
+        with open(TRACE_OUT_FILE, "wt") as handle:
+            handle.seek(0)
+            write_merge_trace(handle, imageId, mergeTrace)
+    except OSError:
+        sys.exit(f"Error writing {TRACE_OUT_FILE}")
+
+def read_input_file(inputFile):
+    # read an image file and print some info about it; see read_image()
+
+    if not os.path.isfile(inputFile):
+        sys.exit(f"Input file not found: {inputFile}")
     try:
         with open(inputFile, "rb") as handle:
             handle.seek(0)
             image = Image.open(handle)
             (imgTiles, nesPalette, imgWidth) = read_image(image)
     except OSError:
-        sys.exit("Error reading input file.")
-
-    imgHeight = len(imgTiles) // imgWidth
+        sys.exit(f"Error reading input file: {inputFile}")
 
     print("Input file: {}, {}*{} tiles, {} distinct tiles".format(
-        os.path.basename(inputFile), imgWidth, imgHeight, len(set(imgTiles))
+        os.path.basename(inputFile), imgWidth, len(imgTiles) // imgWidth,
+        len(set(imgTiles))
     ))
 
+    return (imgTiles, nesPalette, imgWidth)
+
+def make_gallery(args):
+    # convert several images into data for gallery.asm
+
+    startTime = time.time()
+
+    # convert each image separately; eliminate tiles if necessary
+    images = []
+    for inputFile in args.input_files:
+        (imgTiles, nesPalette, imgWidth) = read_input_file(inputFile)
+        origDistinctImgTiles = sorted(set(imgTiles) | set((BLANK_TILE,)))
+
+        elimStartTime = time.time()
+        (bgTileIndexes, spriteData, totalError) = eliminate_and_assign_tiles(
+            origDistinctImgTiles, imgTiles, imgWidth, nesPalette,
+            args.max_bg_tiles, [], args.index
+        )
+        if totalError > 0:
+            maxError = len(imgTiles) * TILE_WIDTH * TILE_HEIGHT * 1536
+            print(
+                "The number of distinct tiles was reduced (quality loss "
+                "{:.2f}%, time {:.1f} s)".format(
+                    totalError / maxError * 100, time.time() - elimStartTime
+                )
+            )
+
+        images.append((
+            [origDistinctImgTiles[i] for i in bgTileIndexes],
+            [
+                (x, y, origDistinctImgTiles[t1], origDistinctImgTiles[t2])
+                for (x, y, t1, t2) in spriteData
+            ],
+            nesPalette,
+            imgWidth
+        ))
+
+    # distinct background tiles and sprite tile pairs of each image
+    imgTileSets = [
+        (
+            set(bgTiles) | set((BLANK_TILE,)),
+            set((t1, t2) for (x, y, t1, t2) in sprites)
+        ) for (bgTiles, sprites, nesPalette, imgWidth) in images
+    ]
+    distinctTileCnt = len(set(itertools.chain.from_iterable(
+        bgTiles | set(itertools.chain.from_iterable(sprTilePairs))
+        for (bgTiles, sprTilePairs) in imgTileSets
+    )))
+
+    groups = group_gallery_images(imgTileSets, args.max_bg_tiles)
+    (prgBanks, tables, chrTileCnt) = get_gallery_data(images, groups)
+
+    # the fixed bank comes last; pad the total number of banks to a power of
+    # two as long as the ROM fits on a real board
+    prgBankCnt = 2
+    while prgBankCnt < len(prgBanks) + 1:
+        prgBankCnt *= 2
+    if prgBankCnt > MAX_REAL_PRG_BANKS:
+        prgBankCnt = len(prgBanks) + 1
+    if prgBankCnt > MAX_PRG_BANKS:
+        sys.exit(
+            "Error: the images don't fit in {} KiB of PRG ROM.".format(
+                MAX_PRG_BANKS * PRG_BANK_SIZE // 1024
+            )
+        )
+    prgBanks.extend(
+        bytearray() for i in range(prgBankCnt - 1 - len(prgBanks))
+    )
+
+    print(
+        "{} images, {} distinct tiles in all images, {} tiles stored in {} "
+        "CHR sets, {} KiB of PRG ROM".format(
+            len(images), distinctTileCnt, chrTileCnt, len(groups),
+            prgBankCnt * PRG_BANK_SIZE // 1024
+        )
+    )
+    if prgBankCnt > MAX_REAL_PRG_BANKS:
+        print(
+            "Warning: more than {} KiB of PRG ROM only works in emulators "
+            "that extend the UNROM mapper.".format(
+                MAX_REAL_PRG_BANKS * PRG_BANK_SIZE // 1024
+            )
+        )
+
+    try:
+        with open(GALLERY_INC_OUT_FILE, "wt") as handle:
+            handle.seek(0)
+            handle.write(
+                "; generated by png2nesdata.py; used by gallery.asm\n"
+                f"prg_bank_count  equ {prgBankCnt}\n"
+                f"image_count     equ {len(images)}\n"
+            )
+    except OSError:
+        sys.exit(f"Error writing {GALLERY_INC_OUT_FILE}")
+
+    try:
+        with open(GALLERY_PRG_OUT_FILE, "wb") as handle:
+            handle.seek(0)
+            for bank in prgBanks:
+                handle.write(bank)
+                handle.write(bytes((PRG_BANK_SIZE - len(bank)) * [0xff]))
+    except OSError:
+        sys.exit(f"Error writing {GALLERY_PRG_OUT_FILE}")
+
+    try:
+        with open(GALLERY_TABLE_OUT_FILE, "wb") as handle:
+            handle.seek(0)
+            handle.write(tables)
+    except OSError:
+        sys.exit(f"Error writing {GALLERY_TABLE_OUT_FILE}")
+
+    print("Wrote {}, {} and {} (total time {:.1f} s)".format(
+        GALLERY_INC_OUT_FILE, GALLERY_PRG_OUT_FILE, GALLERY_TABLE_OUT_FILE,
+        time.time() - startTime
+    ))
+
+def main():
+    startTime = time.time()
+
+    args = parse_arguments()
+    if args.gallery:
+        make_gallery(args)
+        return
+
+    (imgTiles, nesPalette, imgWidth) = read_input_file(args.input_files[0])
+    imgHeight = len(imgTiles) // imgWidth
+
     # pixels of each originally distinct tile; does not change during
     # elimination of tiles; blank tile needed for margins and behind sprites
     origDistinctImgTiles = sorted(set(imgTiles) | set((BLANK_TILE,)))
 
+    # for converting errors into percentages
+    maxError = imgWidth * imgHeight * TILE_WIDTH * TILE_HEIGHT * 1536
+
+    if args.estimate:
+        (elimCnt, predictedTime, predictedError) = estimate_elimination(
+            origDistinctImgTiles, imgTiles, imgWidth, nesPalette,
+            args.max_bg_tiles, args.index
+        )
+        if elimCnt == 0:
+            print("No tiles need to be eliminated (no quality loss).")
+        else:
+            print(
+                "At least {} distinct tiles need to be eliminated (predicted "
+                "quality loss {:.2f}%, predicted time {:.1f} s)".format(
+                    elimCnt, predictedError / maxError * 100, predictedTime
+                )
+            )
+        print("Estimated in {:.3f} s".format(time.time() - startTime))
+        return
+
+    # which tile index was originally in each tile position
+    origImgTileIndexes = [origDistinctImgTiles.index(t) for t in imgTiles]
+
+    # read merge trace
+    imageId = get_image_id(
+        origDistinctImgTiles, origImgTileIndexes, imgWidth, nesPalette
+    )
+    if args.trace is None:
+        mergeTrace = []
+    else:
+        try:
+            with open(args.trace, "rt") as handle:
+                handle.seek(0)
+                mergeTrace = read_merge_trace(
+                    handle, imageId, len(origDistinctImgTiles)
+                )
+        except OSError:
+            sys.exit("Error reading merge trace file.")
+
+    if args.budget_sweep:
+        elimStartTime = time.time()
+        for merge in generate_merges(
+            origDistinctImgTiles, origImgTileIndexes, nesPalette, mergeTrace,
+            args.index
+        ):
+            pass
+        print("All tiles merged (time {:.1f} s)".format(
+            time.time() - elimStartTime
+        ))
+        print("Distinct background tiles and quality loss:")
+        for (tileCnt, totalError) in get_budget_sweep(
+            origImgTileIndexes, imgWidth, mergeTrace
+        ):
+            print("{:4} {:6.2f}%".format(tileCnt, totalError / maxError * 100))
+        write_trace_file(imageId, mergeTrace)
+        print("Wrote {} (total time {:.1f} s)".format(
+            TRACE_OUT_FILE, time.time() - startTime
+        ))
+        return
+
     elimStartTime = time.time()
     (bgTileIndexes, spriteData, totalError) = eliminate_and_assign_tiles(
-        origDistinctImgTiles, imgTiles, imgWidth, nesPalette
+        origDistinctImgTiles, imgTiles, imgWidth, nesPalette,
+        args.max_bg_tiles, mergeTrace, args.index
     )
     if totalError > 0:
-        maxError = imgWidth * imgHeight * TILE_WIDTH * TILE_HEIGHT * 1536
         print(
             "The number of distinct tiles was reduced (quality loss {:.2f}%, "
             "time {:.1f} s)".format(
@@ -739,8 +1715,10 @@ def main():
     except OSError:
         sys.exit(f"Error writing {CHR_OUT_FILE}")
 
-    print("Wrote {} and {} (total time {:.1f} s)".format(
-        PRG_OUT_FILE, CHR_OUT_FILE, time.time() - startTime
+    write_trace_file(imageId, mergeTrace)
+
+    print("Wrote {}, {} and {} (total time {:.1f} s)".format(
+        PRG_OUT_FILE, CHR_OUT_FILE, TRACE_OUT_FILE, time.time() - startTime
     ))
 
 main()
@@ -72,7 +72,11 @@ python3 png2nesdata.py test-in/wolf-32x25.png
 asm6 stillimage.asm   test-out/wolf-32x25.nes
 echo
 
-rm -f prg.bin chr.bin
+python3 png2nesdata.py --gallery --index test-in/*.png
+asm6 gallery.asm      test-out/gallery.nes
+echo
+
+rm -f prg.bin chr.bin trace.txt gallery.inc gallery-prg.bin gallery-tables.bin
 
 echo "test-out/:"
 ls -1 test-out/